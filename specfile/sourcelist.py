@@ -21,8 +21,17 @@ class SourcelistEntry:
         comments: List of comments associated with the source/patch.
     """
 
+    # a spec file can contain hundreds of sources/patches, avoid
+    # a per-instance __dict__
+    __slots__ = ("_location", "comments", "_context", "_expanded_location")
+
     def __init__(
-        self, location: str, comments: Comments, context: Optional["Specfile"] = None
+        self,
+        location: str,
+        comments: Comments,
+        context: Optional["Specfile"] = None,
+        *,
+        _nocopy: bool = False,
     ) -> None:
         """
         Constructs a `SourceListEntry` object.
@@ -36,9 +45,19 @@ class SourcelistEntry:
             Constructed instance of `SourceListEntry` class.
         """
         self.location = location
-        self.comments = comments.copy()
+        self.comments = comments if _nocopy else comments.copy()
         self._context = context
 
+    @property
+    def location(self) -> str:
+        """Literal location of the source/patch as stored in the spec file."""
+        return self._location
+
+    @location.setter
+    def location(self, value: str) -> None:
+        self._location = value
+        self._expanded_location: Optional[str] = None
+
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, SourcelistEntry):
             return NotImplemented
@@ -51,9 +70,12 @@ class SourcelistEntry:
     @property
     def expanded_location(self) -> str:
         """URL of the source/patch after expanding macros."""
-        if self._context:
-            return self._context.expand(self.location)
-        return Macros.expand(self.location)
+        if self._expanded_location is None:
+            if self._context:
+                self._expanded_location = self._context.expand(self.location)
+            else:
+                self._expanded_location = Macros.expand(self.location)
+        return self._expanded_location
 
 
 class Sourcelist(collections.UserList):
@@ -68,6 +90,8 @@ class Sourcelist(collections.UserList):
         self,
         data: Optional[List[SourcelistEntry]] = None,
         remainder: Optional[List[str]] = None,
+        *,
+        _nocopy: bool = False,
     ) -> None:
         """
         Constructs a `Sourcelist` object.
@@ -81,8 +105,11 @@ class Sourcelist(collections.UserList):
         """
         super().__init__()
         if data is not None:
-            self.data = data.copy()
-        self._remainder = remainder.copy() if remainder is not None else []
+            self.data = data if _nocopy else data.copy()
+        if remainder is not None:
+            self._remainder = remainder if _nocopy else remainder.copy()
+        else:
+            self._remainder = []
 
     def __repr__(self) -> str:
         data = repr(self.data)
@@ -99,7 +126,8 @@ class Sourcelist(collections.UserList):
 
     def __getitem__(self, i):
         if isinstance(i, slice):
-            return Sourcelist(self.data[i], self._remainder)
+            # the slice is a fresh list, only the remainder needs to be copied
+            return Sourcelist(self.data[i], self._remainder.copy(), _nocopy=True)
         else:
             return self.data[i]
 
@@ -123,12 +151,20 @@ class Sourcelist(collections.UserList):
         data = []
         buffer: List[str] = []
         for line in section:
-            if line and not line.lstrip().startswith("#"):
-                data.append(SourcelistEntry(line, Comments.parse(buffer), context))
-                buffer = []
-            else:
+            if not line:
                 buffer.append(line)
-        return cls(data, buffer)
+                continue
+            first = line[0]
+            # check the first character to avoid stripping lines
+            # that can't possibly start with a comment
+            if first == "#" or (first.isspace() and line.lstrip().startswith("#")):
+                buffer.append(line)
+            else:
+                data.append(
+                    SourcelistEntry(line, Comments.parse(buffer), context, _nocopy=True)
+                )
+                buffer = []
+        return cls(data, buffer, _nocopy=True)
 
     def get_raw_section_data(self) -> List[str]:
         """
@@ -137,9 +173,12 @@ class Sourcelist(collections.UserList):
         Returns:
             List of lines forming the reconstructed section data.
         """
-        result = []
+        result: List[str] = []
+        # bind the methods to locals to avoid attribute lookups per entry
+        extend = result.extend
+        append = result.append
         for source in self.data:
-            result.extend(source.comments.get_raw_data())
-            result.append(source.location)
-        result.extend(self._remainder)
+            extend(source.comments.get_raw_data())
+            append(source.location)
+        extend(self._remainder)
         return result
@@ -1,7 +1,9 @@
 # Copyright Contributors to the Packit project.
 # SPDX-License-Identifier: MIT
 
+import collections
 import contextlib
+import functools
 import logging
 import os
 import re
@@ -13,13 +15,60 @@ import rpm
 
 from specfile.exceptions import RPMException
 from specfile.macros import Macros
-from specfile.sections import Section
+from specfile.sections import SECTION_NAMES, Section
 from specfile.tags import Tags
 from specfile.utils import capture_stderr, get_filename_from_location
 from specfile.value_parser import ConditionalMacroExpansion, ShellExpansion, ValueParser
 
 logger = logging.getLogger(__name__)
 
+# source references: %SOURCEN, %{SOURCEN}, %{S:N}
+SOURCE_REF_REGEX = re.compile(r"%((?P<b>{)?[?!]*SOURCE\d+(?(b)})|{S:\d+})")
+
+INCLUDE_REGEX = re.compile(r"^\s*%include\s+(.*)$")
+
+# file signatures per extension, based on rpmFileIsCompressed()
+# in rpmio/rpmfileutil.c in RPM source
+SIGNATURES = {
+    ".bz2": b"BZh",
+    ".zip": b"PK00",
+    ".xz": b"\xfd\x37\x7a\x58\x5a\x00",
+    ".zst": b"\x28\xb5\x2f",
+    ".lz": b"LZIP",
+    ".lrz": b"LRZI",
+    ".gz": b"\x1f\x8b",
+    ".7z": b"7z\xbc\xaf\x27\x1c",
+}
+
+# number of bytes that RPM reads to determine the file type
+MAGIC_LENGTH = 13
+
+PADDED_SIGNATURES = {
+    ext: sig.ljust(MAGIC_LENGTH, b"\x00") for ext, sig in SIGNATURES.items()
+}
+
+# fallback for extensions without a known signature
+EMPTY_MAGIC = MAGIC_LENGTH * b"\x00"
+
+SECTION_START_REGEX = re.compile(
+    rf"^%(?:{'|'.join(re.escape(n) for n in sorted(SECTION_NAMES, key=len, reverse=True))})(\s|$)",
+    re.IGNORECASE,
+)
+
+
+# parsing the same content repeatedly is common when parse attempts are retried,
+# keep the cache small to avoid retaining references to large contents
+@functools.lru_cache(maxsize=4)
+def _parse_tags(lines: Tuple[str, ...]) -> Tags:
+    """Parses tags in the preamble of a spec file split into lines."""
+    # tags referencing sources can only appear before the first explicit
+    # section, don't waste time parsing the rest of the spec file
+    for index, line in enumerate(lines):
+        if line.startswith("%") and SECTION_START_REGEX.match(line):
+            lines = lines[:index]
+            break
+    return Tags.parse(Section("package", list(lines)))
+
 
 class SpecParser:
     """
@@ -73,43 +122,37 @@ class SpecParser:
         Yields:
             List of paths to each created dummy source.
         """
-        # based on rpmFileIsCompressed() in rpmio/rpmfileutil.c in RPM source
-        SIGNATURES = [
-            (".bz2", b"BZh"),
-            (".zip", b"PK00"),
-            (".xz", b"\xfd\x37\x7a\x58\x5a\x00"),
-            (".zst", b"\x28\xb5\x2f"),
-            (".lz", b"LZIP"),
-            (".lrz", b"LRZI"),
-            (".gz", b"\x1f\x8b"),
-            (".7z", b"7z\xbc\xaf\x27\x1c"),
-        ]
-        # number of bytes that RPM reads to determine the file type
-        MAGIC_LENGTH = 13
+
+        def create_dummy_source(path, data):
+            # exclusive creation replaces the stat-then-write sequence
+            # with a single open syscall
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                return False
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            return True
+
         dummy_sources = []
         for source in sources:
             filename = get_filename_from_location(source)
             if not filename:
                 continue
             path = self.sourcedir / filename
-            if path.is_file():
-                continue
-            dummy_sources.append(path)
-            for ext, magic in SIGNATURES:
-                if filename.endswith(ext):
-                    path.write_bytes(magic.ljust(MAGIC_LENGTH, b"\x00"))
-                    break
-            else:
-                path.write_bytes(MAGIC_LENGTH * b"\x00")
+            ext = os.path.splitext(filename)[1]
+            magic = PADDED_SIGNATURES.get(ext, EMPTY_MAGIC)
+            if create_dummy_source(path, magic):
+                dummy_sources.append(path)
         for source in non_empty_sources:
             filename = get_filename_from_location(source)
             if not filename:
                 continue
             path = self.sourcedir / filename
-            if path.is_file():
-                continue
-            dummy_sources.append(path)
-            path.write_text("DUMMY")
+            if create_dummy_source(path, b"DUMMY"):
+                dummy_sources.append(path)
         yield dummy_sources
         for path in dummy_sources:
             path.unlink()
@@ -158,15 +201,23 @@ class SpecParser:
         Raises:
             RPMException, if parsing error occurs.
         """
-
-        def get_rpm_spec(content, flags):
-            Macros.reinit()
-            for name, value in self.macros + (extra_macros or []):
-                Macros.define(name, value)
-            Macros.define("_sourcedir", str(self.sourcedir))
-            with tempfile.NamedTemporaryFile() as tmp:
-                tmp.write(content.encode())
-                tmp.flush()
+        # reuse a single temporary file for all parse attempts, the content
+        # is the same for each of them so it only needs to be written once
+        tmp = tempfile.NamedTemporaryFile()
+        try:
+            tmp.write(content.encode())
+            tmp.flush()
+
+            def setup_macros():
+                Macros.reinit()
+                for name, value in self.macros + (extra_macros or []):
+                    Macros.define(name, value)
+                Macros.define("_sourcedir", str(self.sourcedir))
+
+            def get_rpm_spec(flags):
+                # parsing itself mutates the global macro context, reset it
+                # before every attempt so they all start from the same state
+                setup_macros()
                 try:
                     with self._sanitize_environment():
                         with capture_stderr() as stderr:
@@ -174,114 +225,166 @@ class SpecParser:
                 except ValueError as e:
                     raise RPMException(stderr=stderr) from e
 
-        def collect_sources_referenced_from_tags(content):
-            # collect sources referenced from shell expansions in tag values
-
-            def flatten(nodes):
-                result = []
-                for node in nodes:
-                    if isinstance(node, ConditionalMacroExpansion):
-                        result.extend(flatten(node.body))
-                    else:
-                        result.append(node)
-                return result
-
-            # source references: %SOURCEN, %{SOURCEN}, %{S:N}
-            source_ref_regex = re.compile(r"%((?P<b>{)?[?!]*SOURCE\d+(?(b)})|{S:\d+})")
-            sources = set()
-            for tag in Tags.parse(Section("package", content.splitlines())):
-                # we can expand macros here because the first non-build parse,
-                # even though it failed, populated the macro context
-                if Macros.expand(tag.value):
-                    # tag value doesn't expand to an empty string, so it won't
-                    # break parsing, we can skip this tag
-                    continue
-                refs = []
-                for node in flatten(ValueParser.parse(tag.value)):
-                    if isinstance(node, ShellExpansion):
-                        for m in source_ref_regex.finditer(node.body):
-                            refs.append(m.group(0))
-                for ref in refs:
+            sourcedir_key = None
+
+            def is_in_sourcedir(source):
+                # equivalent of source.parent.samefile(self.sourcedir) that stats
+                # sourcedir only once no matter how many sources are checked
+                nonlocal sourcedir_key
+                if sourcedir_key is None:
+                    st = os.stat(self.sourcedir)
+                    sourcedir_key = (st.st_dev, st.st_ino)
+                try:
+                    st = os.stat(source.parent)
+                except OSError:
+                    return False
+                return (st.st_dev, st.st_ino) == sourcedir_key
+
+            def collect_sources_referenced_from_tags(lines):
+                # collect sources referenced from shell expansions in tag values
+
+                def flatten(nodes):
+                    # iterative to avoid Python call overhead per nesting level
+                    # and RecursionError on deeply nested macros
+                    result = []
+                    stack = list(reversed(nodes))
+                    while stack:
+                        node = stack.pop()
+                        if isinstance(node, ConditionalMacroExpansion):
+                            stack.extend(reversed(node.body))
+                        else:
+                            result.append(node)
+                    return result
+
+                sources = set()
+                for tag in _parse_tags(lines):
+                    if "SOURCE" not in tag.value and "S:" not in tag.value:
+                        # the value can't possibly contain a source reference,
+                        # don't bother expanding it
+                        continue
                     # we can expand macros here because the first non-build parse,
                     # even though it failed, populated the macro context
-                    source = Path(Macros.expand(ref))
+                    if Macros.expand(tag.value):
+                        # tag value doesn't expand to an empty string, so it won't
+                        # break parsing, we can skip this tag
+                        continue
+                    if "%(" not in tag.value and "%[" not in tag.value:
+                        # no shell or expression expansion the sources could be
+                        # referenced from, no need to parse the value
+                        continue
+                    refs = []
+                    for node in flatten(ValueParser.parse(tag.value)):
+                        if isinstance(node, ShellExpansion):
+                            for m in SOURCE_REF_REGEX.finditer(node.body):
+                                refs.append(m.group(0))
+                    if not refs:
+                        continue
+                    # we can expand macros here because the first non-build parse,
+                    # even though it failed, populated the macro context;
+                    # expand all references in one go to avoid a round trip into
+                    # librpm per reference, joined by a control character that
+                    # can't appear in the expanded locations
+                    separator = "\x1f"
+                    expanded = Macros.expand(separator.join(refs))
+                    for ref in expanded.split(separator):
+                        source = Path(ref)
+                        # ignore files outside of sourcedir
+                        if is_in_sourcedir(source):
+                            sources.add(source.name)
+                return sources
+
+            def collect_included_sources(lines):
+                # collect sources included using %include
+                sources: Set[str] = set()
+                if "%include" not in content:
+                    return sources
+                lines = collections.deque(lines)
+                while lines:
+                    line = lines.popleft()
+                    if "%include" not in line:
+                        # avoid running the regex against lines that can't match
+                        continue
+                    m = INCLUDE_REGEX.match(line)
+                    if not m:
+                        continue
+                    arg = m.group(1)
+                    while line.endswith("\\"):
+                        line = lines.popleft()
+                        arg = arg[:-1] + line
+                    # we can expand macros here because the first non-build parse,
+                    # even though it failed, populated the macro context
+                    source = Path(Macros.expand(arg))
                     # ignore files outside of sourcedir
-                    if source.parent.samefile(self.sourcedir):
+                    if is_in_sourcedir(source):
                         sources.add(source.name)
-            return sources
-
-        def collect_included_sources(content):
-            # collect sources included using %include
-            include_regex = re.compile(r"^\s*%include\s+(.*)$")
-            lines = content.splitlines()
-            sources = set()
-            while lines:
-                line = lines.pop(0)
-                m = include_regex.match(line)
-                if not m:
-                    continue
-                arg = m.group(1)
-                while line.endswith("\\"):
-                    line = lines.pop(0)
-                    arg = arg[:-1] + line
-                # we can expand macros here because the first non-build parse,
-                # even though it failed, populated the macro context
-                source = Path(Macros.expand(arg))
-                # ignore files outside of sourcedir
-                if source.parent.samefile(self.sourcedir):
-                    sources.add(source.name)
-            return sources
-
-        tainted = False
-        try:
-            # do a non-build parse first, to get a list of sources
-            spec = get_rpm_spec(content, rpm.RPMSPEC_ANYARCH | rpm.RPMSPEC_FORCE)
-            sources = {s for s, _, _ in spec.sources}
-            non_empty_sources = set()
-        except RPMException:
-            if not self.force_parse:
-                raise
-            else:
-                sources = collect_included_sources(content)
-                non_empty_sources = collect_sources_referenced_from_tags(content)
-                if not sources and not non_empty_sources:
-                    # no point in trying again
+                return sources
+
+            def all_sources_present(sources):
+                for source in sources:
+                    filename = get_filename_from_location(source)
+                    if filename and not (self.sourcedir / filename).is_file():
+                        return False
+                return True
+
+            tainted = False
+            try:
+                # do a non-build parse first, to get a list of sources
+                spec = get_rpm_spec(rpm.RPMSPEC_ANYARCH | rpm.RPMSPEC_FORCE)
+                sources = {s for s, _, _ in spec.sources}
+                non_empty_sources = set()
+                if all_sources_present(sources):
+                    # no dummy sources would be created, meaning the forced parse
+                    # was no different from a full parse, no need to parse again
+                    return spec, tainted
+            except RPMException:
+                if not self.force_parse:
                     raise
-                with self._make_dummy_sources(
-                    sources, non_empty_sources
-                ) as dummy_sources:
-                    if dummy_sources:
-                        filelist = "\n".join(str(ds) for ds in dummy_sources)
-                        logger.warning(
-                            f"Created dummy sources for nonexistent files:\n{filelist}"
-                        )
-                        tainted = True
-                        # do a non-build parse again with dummy sources
-                        spec = get_rpm_spec(
-                            content, rpm.RPMSPEC_ANYARCH | rpm.RPMSPEC_FORCE
-                        )
-                        # spec.sources contains also previously collected
-                        # non empty sources (if any), remove them
-                        sources = {s for s, _, _ in spec.sources} - non_empty_sources
-
-        # workaround RPM lua tables feature/bug
-        #
-        # RPM lua tables are a global storage that is used by lua macros and in turn
-        # also by standard %sources and %patches macros
-        #
-        # they are initialized when a rpm.spec instance is created and destroyed
-        # when a rpm.spec instance is deleted
-        #
-        # when a variable that holds a rpm.spec instance is assigned a new rpm.spec
-        # instance, the old instance is garbage collected afterwards and that destroys
-        # lua tables that were (re)initialized when the new instance was created
-        #
-        # explicitly deleting the old instance before creating a new one prevents this
-        del spec
-
-        with self._make_dummy_sources(sources, non_empty_sources):
-            # do a full parse with dummy sources
-            return get_rpm_spec(content, rpm.RPMSPEC_ANYARCH), tainted
+                else:
+                    # split the content into lines only once and share the result,
+                    # a tuple can also serve as a cache key for _parse_tags()
+                    lines = tuple(content.splitlines())
+                    sources = collect_included_sources(lines)
+                    non_empty_sources = collect_sources_referenced_from_tags(lines)
+                    if not sources and not non_empty_sources:
+                        # no point in trying again
+                        raise
+                    with self._make_dummy_sources(
+                        sources, non_empty_sources
+                    ) as dummy_sources:
+                        if dummy_sources:
+                            filelist = "\n".join(str(ds) for ds in dummy_sources)
+                            logger.warning(
+                                f"Created dummy sources for nonexistent files:\n{filelist}"
+                            )
+                            tainted = True
+                            # do a non-build parse again with dummy sources
+                            spec = get_rpm_spec(rpm.RPMSPEC_ANYARCH | rpm.RPMSPEC_FORCE)
+                            # spec.sources contains also previously collected
+                            # non empty sources (if any), remove them
+                            sources = {
+                                s for s, _, _ in spec.sources
+                            } - non_empty_sources
+
+            # workaround RPM lua tables feature/bug
+            #
+            # RPM lua tables are a global storage that is used by lua macros and in turn
+            # also by standard %sources and %patches macros
+            #
+            # they are initialized when a rpm.spec instance is created and destroyed
+            # when a rpm.spec instance is deleted
+            #
+            # when a variable that holds a rpm.spec instance is assigned a new rpm.spec
+            # instance, the old instance is garbage collected afterwards and that destroys
+            # lua tables that were (re)initialized when the new instance was created
+            #
+            # explicitly deleting the old instance before creating a new one prevents this
+            del spec
+
+            with self._make_dummy_sources(sources, non_empty_sources):
+                # do a full parse with dummy sources
+                return get_rpm_spec(rpm.RPMSPEC_ANYARCH), tainted
+        finally:
+            tmp.close()
 
     def parse(
         self, content: str, extra_macros: Optional[List[Tuple[str, str]]] = None
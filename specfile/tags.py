@@ -2,9 +2,22 @@
 # SPDX-License-Identifier: MIT
 
 import collections
+import functools
 import itertools
 import re
-from typing import Any, Iterable, List, Optional, SupportsIndex, Union, cast, overload
+import sys
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    SupportsIndex,
+    Tuple,
+    Union,
+    overload,
+)
 
 from specfile.sections import Section
 
@@ -72,6 +85,8 @@ TAGS_WITH_ARG = {
 }
 
 
+# effectively bounded by the set of tag names appearing in spec files
+@functools.lru_cache(maxsize=None)
 def get_tag_name_regex(name: str) -> str:
     """Contructs regex corresponding to the specified tag name."""
     regex = re.escape(name)
@@ -82,6 +97,38 @@ def get_tag_name_regex(name: str) -> str:
     return regex
 
 
+COMMENT_REGEX = re.compile(r"^(\s*#\s*)(.*)$")
+
+TAG_NAME_REGEXES = tuple(
+    re.compile(get_tag_name_regex(t), re.IGNORECASE) for t in TAG_NAMES
+)
+
+# alternation of all tag names, longest first so that the leftmost-first
+# matching of re doesn't stop at a name that is a prefix of another one
+TAG_LINE_REGEX = re.compile(
+    r"^(?P<n>"
+    + "|".join(get_tag_name_regex(t) for t in sorted(TAG_NAMES, key=len, reverse=True))
+    + r")(?P<s>\s*:\s*)(?P<v>.+)",
+    re.IGNORECASE,
+)
+
+
+def _strip_leading_empty(lines: List[str]) -> List[str]:
+    """Returns a copy of the given list of lines without leading empty lines."""
+    for i, line in enumerate(lines):
+        if line:
+            return lines[i:]
+    return []
+
+
+def _strip_trailing_empty(lines: List[str]) -> List[str]:
+    """Returns a copy of the given list of lines without trailing empty lines."""
+    for i in reversed(range(len(lines))):
+        if lines[i]:
+            return lines[: i + 1]
+    return []
+
+
 class Comment:
     """
     Class that represents a comment.
@@ -91,6 +138,9 @@ class Comment:
         prefix: Comment prefix (hash character usually surrounded by some amount of whitespace).
     """
 
+    # parsing a spec file creates many instances, avoid a per-instance __dict__
+    __slots__ = ("text", "prefix")
+
     def __init__(self, text: str, prefix: str = "# ") -> None:
         self.text = text
         self.prefix = prefix
@@ -115,6 +165,8 @@ class Comments(collections.UserList):
         self,
         data: Optional[List[Comment]] = None,
         preceding_lines: Optional[List[str]] = None,
+        *,
+        _nocopy: bool = False,
     ) -> None:
         """
         Constructs a `Comments` object.
@@ -128,10 +180,13 @@ class Comments(collections.UserList):
         """
         super().__init__()
         if data is not None:
-            self.data = data.copy()
-        self._preceding_lines = (
-            preceding_lines.copy() if preceding_lines is not None else []
-        )
+            self.data = data if _nocopy else data.copy()
+        if _nocopy and preceding_lines is not None:
+            self._preceding_lines = preceding_lines
+        else:
+            # a single truthiness test covers both None and the common case
+            # of an empty list, which is not worth copying
+            self._preceding_lines = list(preceding_lines) if preceding_lines else []
 
     def __repr__(self) -> str:
         data = repr(self.data)
@@ -140,7 +195,7 @@ class Comments(collections.UserList):
 
     def __contains__(self, item: object) -> bool:
         if isinstance(item, str):
-            return item in [c.text for c in self.data]
+            return any(c.text == item for c in self.data)
         return item in self.data
 
     @property
@@ -158,7 +213,9 @@ class Comments(collections.UserList):
 
     def __getitem__(self, i):
         if isinstance(i, slice):
-            return Comments(self.data[i], self._preceding_lines)
+            # the slice is a fresh list, only the preceding lines
+            # need to be copied
+            return Comments(self.data[i], self._preceding_lines.copy(), _nocopy=True)
         else:
             return self.data[i]
 
@@ -200,7 +257,12 @@ class Comments(collections.UserList):
 
     def index(self, item: Union[Comment, str], *args: Any) -> int:
         if isinstance(item, str):
-            return [c.text for c in self.data].index(item, *args)
+            start = args[0] if args else 0
+            stop = args[1] if len(args) > 1 else len(self.data)
+            for i in range(len(self.data))[start:stop]:
+                if self.data[i].text == item:
+                    return i
+            raise ValueError(f"{item!r} is not in list")
         return self.data.index(item, *args)
 
     def extend(self, other: Union[Iterable[Comment], Iterable[str]]) -> None:
@@ -220,16 +282,17 @@ class Comments(collections.UserList):
         Returns:
             Constructed instance of `Comments` class.
         """
-        comment_regex = re.compile(r"^(\s*#\s*)(.*)$")
+        # find where the trailing block of comments that belongs to the tag
+        # starts, then only that block needs to be run through the regex
+        split = len(lines)
+        while split > 0 and lines[split - 1].lstrip().startswith("#"):
+            split -= 1
         comments: List[Comment] = []
-        preceding_lines: List[str] = []
-        for line in reversed(lines):
-            m = comment_regex.match(line)
-            if not m or preceding_lines:
-                preceding_lines.insert(0, line)
-                continue
-            comments.insert(0, Comment(*reversed(m.groups())))
-        return cls(comments, preceding_lines)
+        for line in lines[split:]:
+            m = COMMENT_REGEX.match(line)
+            if m:
+                comments.append(Comment(*reversed(m.groups())))
+        return cls(comments, lines[:split], _nocopy=True)
 
     def get_raw_data(self) -> List[str]:
         return self._preceding_lines + [str(i) for i in self.data]
@@ -245,6 +308,13 @@ class Tag:
         comments: List of comments associated with the tag.
     """
 
+    # parsing a spec file creates many instances, avoid a per-instance __dict__
+    __slots__ = ("_name", "value", "_expanded_value", "_separator", "comments")
+
+    # bumped whenever a tag is created or renamed; lets Tags detect in-place
+    # renames and invalidate its name index
+    _generation = 0
+
     def __init__(
         self,
         name: str,
@@ -268,10 +338,7 @@ class Tag:
         Returns:
             Constructed instance of `Tag` class.
         """
-        name_regexes = [
-            re.compile(get_tag_name_regex(t), re.IGNORECASE) for t in TAG_NAMES
-        ]
-        if not name or not any(r.match(name) for r in name_regexes):
+        if not name or not any(r.match(name) for r in TAG_NAME_REGEXES):
             raise ValueError(f"Invalid tag name: '{name}'")
         self.name = name
         self.value = value
@@ -279,6 +346,36 @@ class Tag:
         self._separator = separator
         self.comments = comments.copy()
 
+    @classmethod
+    def _unchecked(
+        cls,
+        name: str,
+        value: str,
+        expanded_value: str,
+        separator: str,
+        comments: Comments,
+    ) -> "Tag":
+        # names coming from the parser have already been matched against
+        # the tag regexes and the comments are freshly constructed,
+        # skip the validation and the copy
+        tag = cls.__new__(cls)
+        tag.name = name
+        tag.value = value
+        tag._expanded_value = expanded_value
+        tag._separator = separator
+        tag.comments = comments
+        return tag
+
+    @property
+    def name(self) -> str:
+        """Name of the tag."""
+        return self._name
+
+    @name.setter
+    def name(self, value: str) -> None:
+        self._name = value
+        Tag._generation += 1
+
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, Tag):
             return NotImplemented
@@ -329,7 +426,11 @@ class Tags(collections.UserList):
     """
 
     def __init__(
-        self, data: Optional[List[Tag]] = None, remainder: Optional[List[str]] = None
+        self,
+        data: Optional[List[Tag]] = None,
+        remainder: Optional[List[str]] = None,
+        *,
+        _nocopy: bool = False,
     ) -> None:
         """
         Constructs a `Tags` object.
@@ -343,8 +444,11 @@ class Tags(collections.UserList):
         """
         super().__init__()
         if data is not None:
-            self.data = data.copy()
-        self._remainder = remainder.copy() if remainder is not None else []
+            self.data = data if _nocopy else data.copy()
+        if remainder is not None:
+            self._remainder = remainder if _nocopy else remainder.copy()
+        else:
+            self._remainder = []
 
     def __repr__(self) -> str:
         data = repr(self.data)
@@ -361,85 +465,155 @@ class Tags(collections.UserList):
 
     def __getitem__(self, i):
         if isinstance(i, slice):
-            return Tags(self.data[i], self._remainder)
+            # the slice is a fresh list, only the remainder needs to be copied
+            return Tags(self.data[i], self._remainder.copy(), _nocopy=True)
         else:
             return self.data[i]
 
+    @overload
+    def __setitem__(self, i: SupportsIndex, item: Tag) -> None:
+        pass
+
+    @overload
+    def __setitem__(self, i: slice, item: Iterable[Tag]) -> None:
+        pass
+
+    def __setitem__(self, i, item):
+        super().__setitem__(i, item)
+        self._invalidate_index()
+
     def __delitem__(self, i: Union[SupportsIndex, slice]) -> None:
-        def delete(index):
-            preceding_lines = self.data[index].comments._preceding_lines[:]
-            del self.data[index]
-            # preserve preceding lines of the deleted tag but compress empty lines
-            if index < len(self.data):
-                lines = self.data[index].comments._preceding_lines
-            else:
-                lines = self._remainder
+        def merge(a, b):
+            # preserve preceding lines of a deleted tag but compress empty lines
             delimiter = []
-            if preceding_lines and not preceding_lines[-1] or lines and not lines[0]:
+            if a and not a[-1] or b and not b[0]:
                 delimiter.append("")
-            lines[:] = (
-                list(
-                    reversed(
-                        list(
-                            itertools.dropwhile(
-                                lambda l: not l, reversed(preceding_lines)
-                            )
-                        )
-                    )
-                )
-                + delimiter
-                + list(itertools.dropwhile(lambda l: not l, lines))
-            )
+            return _strip_trailing_empty(a) + delimiter + _strip_leading_empty(b)
 
+        # normalize the indices up front; negative indices and steps are
+        # resolved against the original list and an out-of-range index
+        # raises IndexError before anything has been mutated
         if isinstance(i, slice):
-            for index in reversed(range(len(self.data))[i]):
-                delete(index)
+            deleted = set(range(len(self.data))[i])
         else:
-            delete(i)
+            deleted = {range(len(self.data))[i]}
+        data = []
+        # preceding lines of deleted tags not yet attached to a survivor
+        pending: Optional[List[str]] = None
+        for index, tag in enumerate(self.data):
+            lines = tag.comments._preceding_lines
+            if index in deleted:
+                pending = lines[:] if pending is None else merge(pending, lines)
+            else:
+                if pending is not None:
+                    lines[:] = merge(pending, lines)
+                    pending = None
+                data.append(tag)
+        if pending is not None:
+            self._remainder[:] = merge(pending, self._remainder)
+        self.data = data
 
     def __contains__(self, name: object) -> bool:
-        try:
-            # use parent's __getattribute__() so this method can be called from __getattr__()
-            data = super().__getattribute__("data")
-        except AttributeError:
+        if not isinstance(name, str):
             return False
-        return any(t.name.lower() == cast(str, name).lower() for t in data)
+        return self._lookup(name) is not None
 
     def __getattr__(self, name: str) -> Tag:
-        if name not in self:
+        index = self._lookup(name)
+        if index is None:
             return super().__getattribute__(name)
-        try:
-            return self.data[self.find(name)]
-        except ValueError:
-            raise AttributeError(name)
+        return self.data[index]
 
     def __setattr__(self, name: str, value: Union[Tag, str]) -> None:
-        if name not in self:
-            return super().__setattr__(name, value)
-        try:
-            if isinstance(value, Tag):
-                self.data[self.find(name)] = value
-            else:
-                self.data[self.find(name)].value = value
-        except ValueError:
-            raise AttributeError(name)
+        index = self._lookup(name)
+        if index is None:
+            super().__setattr__(name, value)
+            if name == "data":
+                # the tag list has been replaced, the index no longer applies
+                self._invalidate_index()
+            return
+        if isinstance(value, Tag):
+            self.data[index] = value
+            self._invalidate_index()
+        else:
+            self.data[index].value = value
 
     def __delattr__(self, name: str) -> None:
-        if name not in self:
+        index = self._lookup(name)
+        if index is None:
             return super().__delattr__(name)
-        try:
-            del self.data[self.find(name)]
-        except ValueError:
-            raise AttributeError(name)
+        del self.data[index]
+        self._invalidate_index()
 
     def copy(self) -> "Tags":
         return Tags(self.data, self._remainder)
 
+    def _get_index(self) -> Tuple[Dict[str, int], Set[str]]:
+        # maps lowercased tag names to the index of their first occurrence
+        # in data, also keeping track of names that occur more than once;
+        # built lazily and rebuilt whenever the number of tags or the tag
+        # rename generation changes or a lookup detects a stale entry
+        try:
+            # use parent's __getattribute__() so this method can be called
+            # from __getattr__()
+            data = super().__getattribute__("data")
+        except AttributeError:
+            return {}, set()
+        try:
+            cached = super().__getattribute__("_index")
+        except AttributeError:
+            cached = None
+        if cached is not None:
+            index, duplicated, size, generation = cached
+            if size == len(data) and generation == Tag._generation:
+                return index, duplicated
+        index = {}
+        duplicated = set()
+        for i, tag in enumerate(data):
+            # interned keys make the dict lookups pointer comparisons
+            # in the common case
+            key = sys.intern(tag.name.lower())
+            if index.setdefault(key, i) != i:
+                duplicated.add(key)
+        super().__setattr__("_index", (index, duplicated, len(data), Tag._generation))
+        return index, duplicated
+
+    def _invalidate_index(self) -> None:
+        super().__setattr__("_index", None)
+
+    def _lookup(self, name: str) -> Optional[int]:
+        key = sys.intern(name.lower())
+        try:
+            # use parent's __getattribute__() so this method can be called
+            # from __getattr__()
+            data = super().__getattribute__("data")
+        except AttributeError:
+            return None
+        index, duplicated = self._get_index()
+        i = index.get(key)
+        if i is not None and key not in duplicated and data[i].name.lower() == key:
+            return i
+        # duplicated names always take this path because the indexed slot
+        # alone can't prove first-occurrence semantics; misses and
+        # unconfirmed hits take it because the index can still be stale
+        # after mutations of data that don't change its length, e.g.
+        # reordering; all of these are off the hot path
+        for j, tag in enumerate(data):
+            if tag.name.lower() == key:
+                if j != i:
+                    # the index is stale, rebuild it
+                    self._invalidate_index()
+                    self._get_index()
+                return j
+        if i is not None:
+            self._invalidate_index()
+        return None
+
     def find(self, name: str) -> int:
-        for i, tag in enumerate(self.data):
-            if tag.name.capitalize() == name.capitalize():
-                return i
-        raise ValueError
+        index = self._lookup(name)
+        if index is None:
+            raise ValueError
+        return index
 
     def insert(self, i: int, item: Tag) -> None:
         if i > len(self.data):
@@ -449,10 +623,14 @@ class Tags(collections.UserList):
         else:
             lines = self._remainder
         self.data.insert(i, item)
-        # do not make the new tag part of a condition block (in case there is one)
-        index = next(
-            (i for i, line in enumerate(lines) if line.startswith("%endif")), -1
-        )
+        # do not make the new tag part of a condition block (in case there is one);
+        # search a joined string so the scan runs at C level
+        if lines and lines[0].startswith("%endif"):
+            index = 0
+        else:
+            joined = "\n".join(lines)
+            pos = joined.find("\n%endif")
+            index = joined.count("\n", 0, pos) + 1 if pos >= 0 else -1
         if index >= 0:
             item.comments._preceding_lines[0:0] = lines[: index + 1]
             del lines[: index + 1]
@@ -472,30 +650,23 @@ class Tags(collections.UserList):
             Constructed instance of `Tags` class.
         """
 
-        def regex_pattern(tag):
-            name_regex = get_tag_name_regex(tag)
-            return rf"^(?P<n>{name_regex})(?P<s>\s*:\s*)(?P<v>.+)"
-
-        tag_regexes = [re.compile(regex_pattern(t), re.IGNORECASE) for t in TAG_NAMES]
+        # scan the parsed section once and map tag names to expanded values;
+        # in case of duplicate names the first occurrence wins, the same way
+        # rescanning the section per tag would pick the first matching line
+        expanded_values: Dict[str, str] = {}
+        for pl in parsed_section or []:
+            e = TAG_LINE_REGEX.match(pl)
+            if e:
+                expanded_values.setdefault(e.group("n").lower(), e.group("v"))
         data = []
         buffer: List[str] = []
         for line in raw_section:
-            # find out if there is a match for one of the tag regexes
-            m = next((m for m in (r.match(line) for r in tag_regexes) if m), None)
+            # find out if the line matches one of the tag names
+            m = TAG_LINE_REGEX.match(line)
             if m:
-                # find out if any line in the parsed section matches the same regex
-                tag_regex = re.compile(regex_pattern(m.group("n")))
-                e = next(
-                    (
-                        e
-                        for e in (tag_regex.match(pl) for pl in parsed_section or [])
-                        if e
-                    ),
-                    None,
-                )
-                expanded_value = e.group("v") if e else None
+                expanded_value = expanded_values.get(m.group("n").lower())
                 data.append(
-                    Tag(
+                    Tag._unchecked(
                         m.group("n"),
                         m.group("v"),
                         expanded_value,
@@ -506,7 +677,7 @@ class Tags(collections.UserList):
                 buffer = []
             else:
                 buffer.append(line)
-        return cls(data, buffer)
+        return cls(data, buffer, _nocopy=True)
 
     def get_raw_section_data(self) -> List[str]:
         """
@@ -515,9 +686,11 @@ class Tags(collections.UserList):
         Returns:
             List of lines forming the reconstructed section data.
         """
-        result = []
-        for tag in self.data:
-            result.extend(tag.comments.get_raw_data())
-            result.append(f"{tag.name}{tag._separator}{tag.value}")
-        result.extend(self._remainder)
-        return result
+        # let chain.from_iterable do the flattening in C instead of
+        # growing the result with repeated extend/append calls
+        chunks = [
+            tag.comments.get_raw_data() + [f"{tag.name}{tag._separator}{tag.value}"]
+            for tag in self.data
+        ]
+        chunks.append(self._remainder)
+        return list(itertools.chain.from_iterable(chunks))
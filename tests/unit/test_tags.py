@@ -22,6 +22,80 @@ def test_find():
         tags.find("Epoch")
 
 
+def test_find_after_rename():
+    tags = Tags(
+        [
+            Tag("Name", "test", "test", ": ", Comments()),
+            Tag("Version", "0.1", "0.1", ": ", Comments()),
+        ]
+    )
+    # build the name index
+    assert tags.find("version") == 1
+    tags.version.name = "Epoch"
+    assert "epoch" in tags
+    assert "version" not in tags
+    assert tags.find("Epoch") == 1
+    assert tags.epoch.value == "0.1"
+    tags.epoch = "1"
+    assert tags[1].value == "1"
+
+
+def test_find_duplicate_names():
+    tags = Tags(
+        [
+            Tag("Name", "test", "test", ": ", Comments()),
+            Tag("Version", "0.1", "0.1", ": ", Comments()),
+            Tag("Requires", "make", "make", ": ", Comments()),
+            Tag("Requires", "bash", "bash", ": ", Comments()),
+        ]
+    )
+    # the first occurrence wins
+    assert tags.find("requires") == 2
+    assert tags.requires.value == "make"
+    # renaming a tag can create a duplicate preceding the indexed one
+    tags[0].name = "Requires"
+    assert tags.find("requires") == 0
+    assert tags.requires.value == "test"
+    assert "name" not in tags
+    # reordering tags must not return a stale first occurrence either
+    tags[0].name = "Name"
+    tags.reverse()
+    assert tags.find("requires") == 0
+    assert tags.requires.value == "bash"
+
+
+def test_delete_tags():
+    tags = Tags(
+        [
+            Tag("Name", "test", "test", ": ", Comments()),
+            Tag("Epoch", "1", "1", ": ", Comments([], ["", "%if 0"])),
+        ],
+        ["%endif"],
+    )
+    # a negative index resolves against the current list
+    del tags[-1]
+    assert [t.name for t in tags] == ["Name"]
+    assert tags._remainder == ["", "%if 0", "%endif"]
+    # an out-of-range index raises before anything is deleted
+    with pytest.raises(IndexError):
+        del tags[1]
+    assert [t.name for t in tags] == ["Name"]
+    del tags[-1]
+    assert not tags
+    tags = Tags(
+        [
+            Tag("Name", "test", "test", ": ", Comments()),
+            Tag("Version", "0.1", "0.1", ": ", Comments()),
+            Tag("Release", "1%{?dist}", "1.fc35", ": ", Comments()),
+            Tag("Epoch", "1", "1", ": ", Comments()),
+            Tag("URL", "https://example.com", "https://example.com", ": ", Comments()),
+        ]
+    )
+    # a negative-step slice deletes the same tags as its normalized equivalent
+    del tags[3:0:-1]
+    assert [t.name for t in tags] == ["Name", "URL"]
+
+
 def test_parse():
     tags = Tags.parse(
         Section(